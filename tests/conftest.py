@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# Shared pytest fixtures
+# Fetches AWS identity and policy data once per session instead of per test
+
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+# orjson parses bytes directly and is several times faster than stdlib json
+# on large list-policies payloads; fall back to json when it is not installed
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj):
+        return orjson.dumps(obj, default=str)
+except ImportError:
+    import json
+
+    _loads = json.loads
+
+    def _dumps(obj):
+        # default=str serializes datetime fields (CreateDate, UpdateDate)
+        return json.dumps(obj, default=str).encode()
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-aws",
+        action="store_true",
+        default=False,
+        help="run tests marked aws_live against the configured AWS account"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    # Live AWS tests pay CLI/API latency on every run; keep them opt-in
+    if config.getoption("--run-aws"):
+        return
+    skip_live = pytest.mark.skip(reason="needs --run-aws")
+    for item in items:
+        if "aws_live" in item.keywords:
+            item.add_marker(skip_live)
+
+
+# Responses are cached on disk so repeated pytest runs skip the AWS round-trip.
+# They hold the account ID, ARN and policy list, so the directory is per-user
+# and private rather than under the shared system temp dir
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "aws-iam-policy-automation"
+)
+
+
+# Profile settings that make boto3 mint temporary credentials (assume-role, SSO,
+# credential_process). Their key IDs change every process, so these profiles
+# are keyed on this config instead
+_ROLE_CONFIG_KEYS = (
+    "role_arn", "source_profile", "credential_source", "web_identity_token_file",
+    "sso_session", "sso_start_url", "sso_account_id", "sso_role_name",
+    "credential_process",
+)
+# Credential sources whose access key ID is static and read locally
+_STATIC_CREDENTIAL_METHODS = frozenset({"env", "shared-credentials-file", "config-file"})
+
+
+def _credentials_tag(aws_session):
+    """Short hash of stable inputs identifying the credentials the session uses."""
+    from botocore.exceptions import ProfileNotFound
+    
+    try:
+        config = aws_session._session.get_scoped_config()
+    except ProfileNotFound:
+        config = {}
+    parts = [
+        aws_session.profile_name or "",
+        os.environ.get("AWS_ACCESS_KEY_ID", ""),
+        os.environ.get("AWS_ROLE_ARN", ""),
+    ]
+    role_config = [f"{name}={config[name]}" for name in _ROLE_CONFIG_KEYS if name in config]
+    if role_config:
+        # Keyed on config alone: resolving credentials here would run the
+        # AssumeRole/SSO/process call the cache exists to avoid
+        parts += role_config
+    else:
+        # Static keys (env, ~/.aws/credentials) are read without any network call
+        credentials = aws_session.get_credentials()
+        if credentials is not None and credentials.method in _STATIC_CREDENTIAL_METHODS:
+            parts.append(credentials.access_key)
+    # Hashed to keep the access key ID out of file names
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+
+def _prune(key, ttl):
+    """Delete expired cache files (and leftover temp files) for key."""
+    now = time.time()
+    for path in CACHE_DIR.glob(f"{key}-*"):
+        try:
+            if now - path.stat().st_mtime >= ttl:
+                path.unlink()
+        except OSError:
+            pass  # Raced with another worker or unremovable; harmless
+
+
+def _cached(key, ttl, fn, aws_session):
+    """Return fn() from the disk cache if younger than ttl seconds, else refresh it."""
+    if os.environ.get("IAM_TEST_NO_CACHE") == "1":
+        # Round-trip so results have the same types (datetimes as str) as a hit
+        return _loads(_dumps(fn()))
+
+    cache_file = CACHE_DIR / f"{key}-{_credentials_tag(aws_session)}.json"
+    try:
+        entry = _loads(cache_file.read_bytes())
+        if time.time() - entry["ts"] < ttl:
+            return entry["data"]
+    except (OSError, ValueError, KeyError):
+        pass  # Missing or corrupt cache: fall through and refresh
+
+    payload = _dumps({"ts": time.time(), "data": fn()})
+    # Write-then-rename keeps concurrent xdist workers from reading a partial file
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp_file.write_bytes(payload)
+        os.replace(tmp_file, cache_file)
+        # Entries from rotated or abandoned credentials would otherwise pile up
+        _prune(key, ttl)
+    except OSError:
+        pass  # Unwritable cache only costs the next run a refetch
+    # Decoded from the same bytes a later hit reads, so both return equal types
+    return _loads(payload)["data"]
+
+
+@pytest.fixture(scope="session")
+def aws_session():
+    """boto3 Session shared by every client in the test session."""
+    boto3 = pytest.importorskip("boto3")
+    return boto3.Session()
+
+
+def _client_config():
+    from botocore.config import Config
+    return Config(max_pool_connections=4, retries={"max_attempts": 2})
+
+
+@pytest.fixture(scope="session")
+def sts(aws_session):
+    """Session-scoped STS client; service models are parsed only once."""
+    return aws_session.client("sts", config=_client_config())
+
+
+@pytest.fixture(scope="session")
+def iam(aws_session):
+    """Session-scoped IAM client; service models are parsed only once."""
+    return aws_session.client("iam", config=_client_config())
+
+
+@pytest.fixture(scope="session")
+def caller_identity(request, aws_session):
+    """STS GetCallerIdentity response, fetched once per session."""
+    # Clients are resolved lazily so a disk-cache hit never builds one
+    def fetch():
+        return request.getfixturevalue("sts").get_caller_identity()
+    return _cached("identity", 900, fetch, aws_session)
+
+
+@pytest.fixture(scope="session")
+def local_policies(request, aws_session):
+    """All customer-managed policies (--scope Local), fetched once per session."""
+    def fetch():
+        paginator = request.getfixturevalue("iam").get_paginator("list_policies")
+        return list(paginator.paginate(Scope="Local").build_full_result()["Policies"])
+    return _cached("local_policies", 300, fetch, aws_session)
@@ -1,12 +1,199 @@
 #!/usr/bin/env python3
 # Security tests: credential protection, gitignore, file permissions
 
+import mmap
 import os
 import re
 from pathlib import Path
 import subprocess
 import pytest
 
+# google-re2 matches in guaranteed linear time over the whole tracked tree;
+# fall back to the stdlib engine when it is not installed
+try:
+    import re2 as _scan_re
+except ImportError:
+    _scan_re = re
+
+# Resolved once at import time and shared by every test and fixture
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _combine(patterns, flags=0, engine=re, as_bytes=False):
+    """Compile (pattern, description) pairs into one alternation, one named group each."""
+    combined = "|".join(f"(?P<p{i}>{p})" for i, (p, _) in enumerate(patterns))
+    if as_bytes:
+        combined = combined.encode()
+    # re2.compile takes an Options object rather than int flags
+    return engine.compile(combined, flags) if flags else engine.compile(combined)
+
+
+def _describe(patterns, match):
+    """Return the description of the pattern that produced a combined-regex match."""
+    # groupdict() works identically on re and re2 match objects
+    name = next(key for key, value in match.groupdict().items() if value is not None)
+    return patterns[int(name[1:])][1]
+
+
+# Each table is compiled once into a single alternation so content is scanned
+# in one pass instead of once per pattern. Keep every table ordered from most
+# to least selective: literal-anchored patterns (AKIA, aws_*_key) first, broad
+# catch-alls (password=, log.*SECRET) last, so rare hits are tried before
+# alternatives that match loosely and backtrack often
+_CREDENTIAL_PATTERNS = (
+    (r"AKIA[0-9A-Z]{16}", "AWS Access Key ID"),
+    (r"aws_access_key_id\s*=\s*AKIA", "Access Key assignment"),
+    (r"aws_secret_access_key\s*=\s*[A-Za-z0-9/+=]{40}", "Secret Key assignment"),
+)
+# Tracked files are scanned as raw bytes: the patterns are pure ASCII, so
+# decoding every file to str would be wasted work
+_CREDENTIAL_RE = _combine(_CREDENTIAL_PATTERNS, engine=_scan_re, as_bytes=True)
+# Every credential pattern contains one of these literals; files without any
+# of them cannot match, so the regex is skipped entirely (gitleaks-style)
+_CREDENTIAL_KEYWORDS = (b"AKIA", b"aws_secret_access_key")
+# Every git call whose output is parsed runs with color forced off, so a user
+# config such as color.ui=always cannot wrap paths in ANSI escape codes
+_GIT = ("git", "-c", "color.ui=never")
+# The same patterns as POSIX ERE for git grep (\s is a PCRE/Python-only class)
+_GIT_GREP_ARGS = tuple(
+    arg
+    for pattern, _ in _CREDENTIAL_PATTERNS
+    for arg in ("-e", pattern.replace(r"\s", "[[:space:]]"))
+)
+# Index modes of symlinks (120000) and submodules (160000); these are filtered
+# out from git's metadata instead of stat-ing each path. Anything else git grep
+# flags, including paths missing from the listing, is still reported
+_SKIPPED_FILE_MODES = frozenset({b"120000", b"160000"})
+# Below this size a plain read() is cheaper than setting up a mapping
+_MMAP_MIN_SIZE = 64 * 1024
+
+_SECRET_PATTERNS = (
+    (r"AKIA[0-9A-Z]{16}", "AWS Access Key ID"),
+    (r"aws_access_key_id\s*=\s*['\"]?AKIA", "Hardcoded Access Key"),
+    (r"aws_secret_access_key\s*=\s*['\"]?[A-Za-z0-9/+=]{40}", "Hardcoded Secret Key"),
+    (r"password\s*=\s*['\"][^'\"]+['\"]", "Hardcoded password"),
+)
+_SECRET_RE = _combine(_SECRET_PATTERNS, re.IGNORECASE)
+# Lowercase literals at least one of which every secret pattern contains
+_SECRET_ANCHORS = ("akia", "aws_secret_access_key", "password")
+
+# Log statements that could leak secrets
+_DANGEROUS_LOG_PATTERNS = (
+    (r"echo.*AWS_SECRET", "echo of AWS_SECRET"),
+    (r"printf.*AWS_SECRET", "printf of AWS_SECRET"),
+    (r"log.*SECRET", "log of SECRET"),
+)
+_DANGEROUS_LOG_RE = _combine(_DANGEROUS_LOG_PATTERNS, re.IGNORECASE)
+
+
+def _has_anchor(content, anchors):
+    """Fast-reject precheck: does content (str, bytes or mmap) contain any anchor literal?"""
+    return any(content.find(anchor) != -1 for anchor in anchors)
+
+
+def _match_credentials(content):
+    """Return descriptions of credential patterns found in bytes or an mmap."""
+    if not _has_anchor(content, _CREDENTIAL_KEYWORDS):
+        return []
+    # One hit is enough to fail the file; stop at the first match
+    match = _CREDENTIAL_RE.search(content)
+    return [_describe(_CREDENTIAL_PATTERNS, match)] if match else []
+
+
+def _find_credentials(full_path):
+    """Scan a file's raw bytes for credentials, memory-mapping larger files."""
+    with open(full_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _MMAP_MIN_SIZE:
+            return _match_credentials(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return _match_credentials(mapped)
+
+
+def _scan_one(repo_root, file_path):
+    """Return credential violations for one tracked file."""
+    # Paths stay as raw bytes from git; they are only decoded for the report
+    full_path = os.path.join(repo_root, file_path)
+    
+    # Every file reaching here was already flagged by git grep, so it is never
+    # dropped: if it cannot be read or labelled it is still reported by name
+    try:
+        descriptions = _find_credentials(full_path)
+    except OSError as e:
+        descriptions = [f"flagged by git grep (unreadable: {e.strerror})"]
+    return [
+        f"{os.fsdecode(file_path)}: {description}"
+        for description in descriptions or ["flagged by git grep"]
+    ]
+
+
+def _gitignore_entry(pattern):
+    """Normalize a .gitignore pattern so "dir" and "dir/" compare equal."""
+    return pattern.strip().rstrip("/")
+
+
+# Entries .gitignore must contain, normalized once for a single set comparison
+_CREDENTIAL_ENTRIES = frozenset(map(_gitignore_entry, (
+    "credentials",  # AWS credentials file
+    ".aws/",        # AWS config directory
+    "*.pem",        # SSH private keys
+    "*.ppk",        # PuTTY private keys
+    ".env",         # Environment variables
+)))
+_PYTHON_CACHE_ENTRIES = frozenset(map(_gitignore_entry, (
+    "__pycache__",
+    "*.pyc",
+    ".pytest_cache",
+)))
+
+
+@pytest.fixture(scope="session")
+def repo_files():
+    """Map of small repository files to (path, text or None if missing), read once."""
+    files = {}
+    for name in (".gitignore", "README.md", "requirements.txt", "download_policy.sh"):
+        path = REPO_ROOT / name
+        files[name] = (path, path.read_text() if path.is_file() else None)
+    return files
+
+
+@pytest.fixture(scope="session")
+def tracked_files():
+    """Map of git index paths (bytes) to their modes, listed once per session."""
+    # ls-files -s prints "<mode> <object> <stage>\t<path>" per entry
+    result = subprocess.run(
+        [*_GIT, "ls-files", "-s", "-z"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        check=False
+    )
+    if result.returncode != 0:
+        # An empty listing would hide every hit; never pass on missing data
+        pytest.skip(f"git ls-files failed: {os.fsdecode(result.stderr).strip()}")
+    
+    modes = {}
+    for record in result.stdout.split(b"\0")[:-1]:
+        meta, _, path = record.partition(b"\t")
+        modes[path] = meta.split(b" ", 1)[0]
+    return modes
+
+
+@pytest.fixture(scope="session")
+def gitignore_data(repo_files):
+    """.gitignore as (content, set of active entries), parsed once per session."""
+    _, content = repo_files[".gitignore"]
+    if content is None:
+        pytest.fail(".gitignore file must exist for security")
+    
+    # Exact entries rather than substrings: a comment that merely mentions
+    # "credentials" must not count as excluding it
+    entries = frozenset(
+        _gitignore_entry(line)
+        for line in content.splitlines()
+        if line.strip() and not line.strip().startswith("#")
+    )
+    return content, entries
+
 
 class TestSecurityCompliance:
     # Verify security best practices
@@ -14,84 +201,59 @@ class TestSecurityCompliance:
     @pytest.fixture(autouse=True)
     def setup(self):
         # Set repo paths
-        self.repo_root = Path(__file__).parent.parent
-        self.gitignore_path = self.repo_root / ".gitignore"
+        self.repo_root = REPO_ROOT
     
-    def test_gitignore_exists(self):
+    def test_gitignore_exists(self, repo_files):
         """Verify gitignore file exists."""
-        assert self.gitignore_path.exists(), ".gitignore must exist"
-        assert self.gitignore_path.is_file(), ".gitignore must be a file"
+        gitignore_path, gitignore_content = repo_files[".gitignore"]
+        assert gitignore_path.exists(), ".gitignore must exist"
+        assert gitignore_content is not None, ".gitignore must be a file"
     
-    def test_gitignore_excludes_credentials(self):
+    def test_gitignore_excludes_credentials(self, gitignore_data):
         """Verify gitignore excludes AWS credential files."""
-        gitignore_content = self.gitignore_path.read_text()
-        
-        critical_patterns = [
-            "credentials",  # AWS credentials file
-            ".aws/",        # AWS config directory
-            "*.pem",        # SSH private keys
-            "*.ppk",        # PuTTY private keys
-            ".env",         # Environment variables
-        ]
+        _, gitignore_entries = gitignore_data
         
-        for pattern in critical_patterns:
-            assert pattern in gitignore_content, \
-                f".gitignore must exclude {pattern}"
+        missing = _CREDENTIAL_ENTRIES - gitignore_entries
+        assert not missing, f".gitignore must exclude {sorted(missing)}"
     
-    def test_gitignore_excludes_python_cache(self):
+    def test_gitignore_excludes_python_cache(self, gitignore_data):
         """Verify gitignore excludes Python cache files."""
-        gitignore_content = self.gitignore_path.read_text()
-        
-        python_patterns = [
-            "__pycache__",
-            "*.pyc",
-            ".pytest_cache",
-        ]
+        _, gitignore_entries = gitignore_data
         
-        for pattern in python_patterns:
-            assert pattern in gitignore_content, \
-                f".gitignore must exclude {pattern}"
+        missing = _PYTHON_CACHE_ENTRIES - gitignore_entries
+        assert not missing, f".gitignore must exclude {sorted(missing)}"
     
-    def test_no_credentials_in_tracked_files(self):
+    def test_no_credentials_in_tracked_files(self, tracked_files):
         """Verify no AWS credentials in git tracked files."""
-        # Check git tracked files for potential credentials
+        # git grep searches every tracked file natively (threaded, binaries
+        # skipped via -I) and lists only the files that match. With -l it stops
+        # reading each file at its first hit, so this pass already short-circuits;
+        # the full per-pattern report below only runs for files that matched
         result = subprocess.run(
-            ["git", "ls-files"],
+            [*_GIT, "grep", "--no-color", "-I", "-E", "-l", "-z", *_GIT_GREP_ARGS],
             cwd=self.repo_root,
-            capture_output=True,
-            text=True
+            capture_output=True
         )
         
-        if result.returncode != 0:
+        # Exit 1 means no match; anything higher is a git error
+        if result.returncode > 1:
             pytest.skip("Not a git repository or git not available")
         
-        tracked_files = result.stdout.strip().split('\n')
-        
-        # Patterns that might indicate credentials
-        credential_patterns = [
-            r"AKIA[0-9A-Z]{16}",  # AWS Access Key ID
-            r"aws_access_key_id\s*=\s*AKIA",
-            r"aws_secret_access_key\s*=\s*[A-Za-z0-9/+=]{40}",
+        # Only matching files reach Python, which labels each hit. -z output is
+        # NUL-terminated, unquoted and safe for any filename; no decode needed
+        # Only paths the shared index listing knows to be symlinks or submodules
+        # are dropped; unknown paths are kept so a hit can never vanish silently
+        candidate_files = [
+            path for path in result.stdout.split(b"\0")[:-1]
+            if tracked_files.get(path) not in _SKIPPED_FILE_MODES
         ]
         
-        violations = []
-        for file_path in tracked_files:
-            full_path = self.repo_root / file_path
-            
-            # Skip binary files and directories
-            if not full_path.is_file():
-                continue
-            
-            try:
-                content = full_path.read_text(encoding='utf-8', errors='ignore')
-                
-                for pattern in credential_patterns:
-                    matches = re.findall(pattern, content)
-                    if len(matches) > 0:
-                        violations.append(f"{file_path}: pattern {pattern}")
-            except Exception as e:
-                # Skip files that can't be read as text
-                continue
+        repo_root = os.fsencode(self.repo_root)
+        violations = [
+            violation
+            for file_path in candidate_files
+            for violation in _scan_one(repo_root, file_path)
+        ]
         
         assert len(violations) == 0, \
             f"No credentials should be in tracked files: {violations}"
@@ -114,30 +276,23 @@ class TestSecurityCompliance:
                 f"Run: chmod 755 download_policy.sh"
             )
     
-    def test_no_hardcoded_secrets_in_script(self):
+    def test_no_hardcoded_secrets_in_script(self, repo_files):
         """Verify script doesn't contain hardcoded secrets."""
-        script_path = self.repo_root / "download_policy.sh"
-        script_content = script_path.read_text()
+        _, script_content = repo_files["download_policy.sh"]
         
-        secret_patterns = [
-            (r"AKIA[0-9A-Z]{16}", "AWS Access Key ID"),
-            (r"aws_access_key_id\s*=\s*['\"]?AKIA", "Hardcoded Access Key"),
-            (r"aws_secret_access_key\s*=\s*['\"]?[A-Za-z0-9/+=]{40}", "Hardcoded Secret Key"),
-            (r"password\s*=\s*['\"][^'\"]+['\"]", "Hardcoded password"),
-        ]
+        # Patterns are case-insensitive, so the anchors are searched in lowercase
+        if not _has_anchor(script_content.lower(), _SECRET_ANCHORS):
+            return
         
-        for pattern, description in secret_patterns:
-            matches = re.findall(pattern, script_content, re.IGNORECASE)
-            assert len(matches) == 0, \
-                f"Potential {description} found in script"
+        match = _SECRET_RE.search(script_content)
+        assert match is None, \
+            f"Potential {_describe(_SECRET_PATTERNS, match)} found in script"
     
-    def test_readme_security_section_exists(self):
+    def test_readme_security_section_exists(self, repo_files):
         """Verify README contains security section."""
-        readme_path = self.repo_root / "README.md"
-        
-        assert readme_path.exists(), "README.md should exist"
+        _, readme_content = repo_files["README.md"]
         
-        readme_content = readme_path.read_text()
+        assert readme_content is not None, "README.md should exist"
         
         assert "Security" in readme_content or "security" in readme_content, \
             "README should have security section"
@@ -156,55 +311,51 @@ class TestSecurityCompliance:
             assert policies_dir.is_dir(), "policies should be a directory"
             
             # Check that policies directory is not excluded by gitignore
-            # (we want to track example policies)
-            gitignore_content = self.gitignore_path.read_text()
+            # (we want to track example policies). git applies its own rules
+            # (negations, **, nested files), so ask it rather than parse lines.
+            # --no-index: policies/ holds tracked files, which check-ignore
+            # otherwise never reports as ignored
+            result = subprocess.run(
+                [*_GIT, "check-ignore", "-v", "--no-index", "--", "policies/"],
+                cwd=self.repo_root,
+                capture_output=True,
+                text=True
+            )
             
-            # Should NOT have "policies/" uncommented at the root level
-            # (The commented line is ok)
-            lines = gitignore_content.split('\n')
-            for line in lines:
-                if line.strip() and not line.strip().startswith('#'):
-                    assert line.strip() != "policies/", \
-                        "policies/ directory should not be fully excluded"
+            # Exit 0 means ignored, 1 means not ignored; anything higher is a git error
+            if result.returncode > 1:
+                pytest.skip(f"git check-ignore failed: {result.stderr.strip()}")
+            assert result.returncode == 1, \
+                f"policies/ directory should not be fully excluded: {result.stdout.strip()}"
 
 
 class TestScriptOutputSecurity:
     """Test that script output doesn't leak sensitive information."""
     
-    def test_script_does_not_log_secret_keys(self):
+    def test_script_does_not_log_secret_keys(self, repo_files):
         """Test 9: Verify script doesn't log AWS Secret Access Keys."""
-        script_path = Path(__file__).parent.parent / "download_policy.sh"
-        script_content = script_path.read_text()
+        _, script_content = repo_files["download_policy.sh"]
         
         # Check that script doesn't echo or log variables that might contain secrets
-        dangerous_patterns = [
-            r'echo.*AWS_SECRET',
-            r'printf.*AWS_SECRET',
-            r'log.*SECRET',
-        ]
-        
-        for pattern in dangerous_patterns:
-            matches = re.findall(pattern, script_content, re.IGNORECASE)
-            assert len(matches) == 0, \
-                f"Script should not log secrets: found pattern {pattern}"
+        match = _DANGEROUS_LOG_RE.search(script_content)
+        assert match is None, \
+            f"Script should not log secrets: found {_describe(_DANGEROUS_LOG_PATTERNS, match)}"
     
-    def test_script_uses_safe_logging(self):
+    def test_script_uses_safe_logging(self, repo_files):
         """Test 10: Verify script uses safe logging practices."""
-        script_path = Path(__file__).parent.parent / "download_policy.sh"
-        script_content = script_path.read_text()
+        _, script_content = repo_files["download_policy.sh"]
         
         # Script should log to stderr (>&2) for informational messages
         # This is a best practice to keep stdout clean for piping
         assert ">&2" in script_content or "stderr" in script_content.lower(), \
             "Script should use stderr for logging"
-    def test_requirements_file_safe(self):
+    def test_requirements_file_safe(self, repo_files):
         """Test 11: Verify requirements.txt contains only package names."""
-        requirements_path = Path(__file__).parent.parent / "requirements.txt"
+        _, requirements_content = repo_files["requirements.txt"]
         
-        if not requirements_path.exists():
+        if requirements_content is None:
             pytest.skip("requirements.txt not found")
         
-        requirements_content = requirements_path.read_text()
         lines = [l.strip() for l in requirements_content.split('\n') if l.strip()]
         
         # Should not contain URLs with credentials
@@ -216,17 +367,12 @@ class TestScriptOutputSecurity:
         assert len(violations) == 0, \
             f"requirements.txt should not contain credentials in URLs: {violations}"
     
-    def test_gitignore_protects_json_files(self):
+    def test_gitignore_protects_json_files(self, gitignore_data):
         """Test 12: Verify .gitignore protects JSON policy files."""
-        gitignore_path = Path(__file__).parent.parent / ".gitignore"
-        
-        if not gitignore_path.exists():
-            pytest.fail(".gitignore file must exist for security")
-        
-        gitignore_content = gitignore_path.read_text()
+        _, gitignore_entries = gitignore_data
         
         # Should contain pattern for JSON files
-        assert "*.json" in gitignore_content or "policies/" in gitignore_content, \
+        assert "*.json" in gitignore_entries or _gitignore_entry("policies/") in gitignore_entries, \
             ".gitignore should protect JSON policy files from accidental commits"
 
 